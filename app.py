@@ -1,6 +1,7 @@
 # app.py
 import streamlit as st
 from predict import predict_labels
+from inference_server import predict_remote
 from copy import deepcopy
 from PIL import ImageDraw, ImageFont
 import os
@@ -24,7 +25,11 @@ def app_main():
         st.image(image, caption="🖼️ Detected Image", use_container_width=True)
 
         if st.button("🎯 Predict Labels"):
-            results = predict_labels(image_path)
+            try:
+                # Batched with other users' requests when the inference server is running
+                results = predict_remote(image_path)
+            except OSError:
+                results = predict_labels(image_path)
 
             label2color = {
                 'key': '#0000FF',
@@ -39,10 +44,12 @@ def app_main():
             draw = ImageDraw.Draw(image_copy)
             font = ImageFont.load_default()
 
-            for pred, box in zip(results["true_predictions"], results["true_boxes"]):
-                color = label2color.get(pred.lower(), "gray")
+            tokens = results["tokens"]
+            token_labels = tokens["label_names"][tokens["token_label_ids"]]
+            for label, box in zip(token_labels, tokens["token_boxes"].tolist()):
+                color = label2color.get(label, "gray")
                 draw.rectangle(box, outline=color, width=2)
-                draw.text((box[0] + 5, box[1] - 10), pred.lower(), fill=color, font=font)
+                draw.text((box[0] + 5, box[1] - 10), label, fill=color, font=font)
 
             st.image(image_copy, caption="📌 Prediction Result", use_container_width=True)
             st.success("✅ Prediction complete!")
@@ -1,16 +1,22 @@
 import streamlit as st
 import pandas as pd
+import io
 import os
+import hashlib
 import re
+import time
 import logging
 from PIL import Image
 import matplotlib.pyplot as plt
-from ratio import clean_number, calculate_ratios, select_key_for_year
-from predict import predict_labels
+from ratio import clean_number, calculate_ratios, select_key_for_year, update_ratios
+from jobs import submit_job, get_jobs, active_workers, POLL_INTERVAL, DONE, FAILED
 
 
 OUTPUT_DIR = "output_images"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+YEAR_PATTERN = r'^\d{4}$|^FY\d{4}$'
+# Bound on memoized ratio / chart results kept across reruns (oldest entries evicted)
+CACHE_MAX_ENTRIES = 32
 #st.set_page_config(page_title="Financial Dashboard", layout="centered")
 
 def is_valid_image(file_path):
@@ -29,42 +35,43 @@ image_files = [
 def load_image(image_file):
     return os.path.join(OUTPUT_DIR, image_file)
 
-def process_all_images():
-    all_dfs = []
-
+def submit_all_images():
     if not image_files:
         st.warning(f"No valid images found in {OUTPUT_DIR}")
         return None
 
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-
-    for i, image_file in enumerate(image_files):
-        try:
-            status_text.text(f"Processing {image_file}... ({i+1}/{len(image_files)})")
-            progress_bar.progress((i + 1) / len(image_files))
-
-            image_path = load_image(image_file)
-            result = predict_labels(image_path)
+    # One prediction job per crop, run by the worker pool (python jobs.py)
+    return {
+        submit_job("predict", {"image_path": load_image(image_file)}): image_file
+        for image_file in image_files
+    }
 
-            if result and "df" in result:
-                df = result["df"]
+def process_all_images(extraction_jobs, collected):
+    """Yield (image_file, df) for each crop whose extraction job has finished.
+
+    Only jobs finished at call time are yielded, the generator never waits for
+    pending ones: callers render what arrived and poll again on the next rerun.
+    Jobs already in collected are skipped and finished job ids are added to it.
+    """
+    remaining = [job_id for job_id in extraction_jobs if job_id not in collected]
+
+    for job_id, job in get_jobs(remaining).items():
+        image_file = extraction_jobs[job_id]
+        if job["status"] == FAILED:
+            collected.add(job_id)
+            logging.error(f"Error with {image_file}: {job['error']}")
+            st.error(f"Erreur avec {image_file}: {job['error']}")
+        elif job["status"] == DONE:
+            collected.add(job_id)
+            if job["result"] and "df" in job["result"]:
+                df = pd.DataFrame(**job["result"]["df"])
                 df["source_image"] = image_file
 
                 numeric_columns = [col for col in df.columns if col not in ['key', 'source_image']]
                 for col in numeric_columns:
                     df[col] = df[col].apply(clean_number)
 
-                all_dfs.append(df)
-
-        except Exception as e:
-            logging.error(f"Error with {image_file}: {str(e)}")
-            st.error(f"Erreur avec {image_file}: {str(e)}")
-            continue
-
-    if all_dfs:
-        return pd.concat(all_dfs, ignore_index=True)
-    return None
+                yield image_file, df
 
 def display_metrics(ratios, selected_year):
     if not ratios or selected_year not in ratios:
@@ -88,10 +95,27 @@ def display_metrics(ratios, selected_year):
         else:
             cols[i].warning(f"{metric} - No data available")
 
-def display_capital_pie_chart(df, selected_year, key_column):
-    st.subheader("Répartition des Capitaux Propres")
+    # Other ratios of ratios.json (including custom ones), shown when available
+    other_ratios = [(m, v) for m, v in year_ratios.items() if m not in metrics_config and v is not None]
+    for start in range(0, len(other_ratios), 4):
+        cols = st.columns(4)
+        for i, (metric, value) in enumerate(other_ratios[start:start + 4]):
+            cols[i].metric(label=metric, value=format(value, ".2f"))
+
+def df_fingerprint(df):
+    """Content hash of a DataFrame, used as cache key across reruns."""
+    hashed = pd.util.hash_pandas_object(df, index=True).values.tobytes()
+    return hashlib.sha1(hashed + repr(list(df.columns)).encode("utf-8")).hexdigest()
 
-    results = select_key_for_year(df, selected_year, key_column=key_column)
+# Memoized by fingerprint and key column: the DataFrame itself is not hashed again (_df)
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_ratios(fingerprint, key_column, _df):
+    return calculate_ratios(_df, key_column=key_column)
+
+# Rendered once per (fingerprint, key column, year), returns the chart as PNG bytes
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def capital_pie_chart(fingerprint, key_column, selected_year, _df):
+    results = select_key_for_year(_df, selected_year, key_column=key_column)
 
     capital_data = {
         'Capital social': results.get('capital_social'),
@@ -104,8 +128,7 @@ def display_capital_pie_chart(df, selected_year, key_column):
     filtered_data = {k: abs(v) for k, v in capital_data.items() if v not in [None, 0]}
 
     if not filtered_data:
-        st.warning("No valid data available for equity composition")
-        return
+        return None
 
     labels = list(filtered_data.keys())
     sizes = list(filtered_data.values())
@@ -123,22 +146,62 @@ def display_capital_pie_chart(df, selected_year, key_column):
         fig.gca().add_artist(centre_circle)
         ax.axis('equal')
         plt.title(f"Composition des capitaux propres ({selected_year})")
-        st.pyplot(fig)
 
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+def display_capital_pie_chart(df, selected_year, key_column, fingerprint=None):
+    st.subheader("Répartition des Capitaux Propres")
+
+    try:
+        chart = capital_pie_chart(fingerprint or df_fingerprint(df), key_column, selected_year, df)
     except ValueError as e:
         st.error(f"Erreur lors de la création du graphique : {str(e)}")
+        return
+
+    if chart is None:
+        st.warning("No valid data available for equity composition")
+        return
+
+    st.image(chart)
 
 def app_financial():
     st.title("📊 Financial Dashboard")
     st.sidebar.header("Settings")
 
     if st.sidebar.button("🔄 Process All Images"):
-        if "df" not in st.session_state:
-            with st.spinner("Extracting data..."):
-                final_df = process_all_images()
-                if final_df is not None:
-                    st.session_state.df = final_df
-                    st.success(f"{len(image_files)} images processed successfully!")
+        if "df" not in st.session_state and "extraction_jobs" not in st.session_state:
+            extraction_jobs = submit_all_images()
+            if extraction_jobs:
+                st.session_state.extraction_jobs = extraction_jobs
+
+    pending = 0
+    if "extraction_jobs" in st.session_state:
+        extraction_jobs = st.session_state.extraction_jobs
+        collected = st.session_state.setdefault("collected_jobs", set())
+        ratio_state = st.session_state.setdefault("ratio_state", {})
+
+        # Rows and ratios are added crop by crop, the dashboard below shows what arrived
+        for image_file, df in process_all_images(extraction_jobs, collected):
+            if "df" in st.session_state:
+                st.session_state.df = pd.concat([st.session_state.df, df], ignore_index=True)
+            else:
+                st.session_state.df = df
+            update_ratios(ratio_state, df, key_column='key')
+
+        pending = len(extraction_jobs) - len(collected)
+        if pending:
+            if not active_workers():
+                st.info("⏳ No job worker running. Start one with `python jobs.py`.")
+            st.progress(len(collected) / len(extraction_jobs))
+            st.text(f"Extracting data... ({len(collected)}/{len(extraction_jobs)})")
+        else:
+            del st.session_state["extraction_jobs"]
+            del st.session_state["collected_jobs"]
+            st.success(f"{len(extraction_jobs)} images processed successfully!")
 
     if st.sidebar.button("🗑 Réinitialiser"):
         st.session_state.clear()
@@ -151,9 +214,14 @@ def app_financial():
             options=list(df.columns),
             index=list(df.columns).index('key') if 'key' in df.columns else 0
         )
+        fingerprint = df_fingerprint(df)
 
         try:
-            ratios = calculate_ratios(df, key_column=key_column)
+            if key_column == 'key' and "ratio_state" in st.session_state:
+                # Already kept up to date row by row during extraction
+                ratios = st.session_state.ratio_state.get('ratios', {})
+            else:
+                ratios = cached_ratios(fingerprint, key_column, df)
             if ratios:
                 st.session_state.ratios = ratios
         except (ValueError, KeyError) as e:
@@ -161,7 +229,7 @@ def app_financial():
 
         year_columns = [
             col for col in df.columns
-            if re.match(r'^\d{4}$|^FY\d{4}$', str(col).strip())
+            if re.match(YEAR_PATTERN, str(col).strip())
             and col not in [key_column, 'source_image']
         ]
 
@@ -175,13 +243,18 @@ def app_financial():
             if "ratios" in st.session_state:
                 display_metrics(st.session_state.ratios, selected_year)
 
-            display_capital_pie_chart(df, selected_year, key_column)
+            display_capital_pie_chart(df, selected_year, key_column, fingerprint)
 
             st.subheader("Raw Data")
             st.dataframe(df)
         else:
             st.warning("No year columns found in the data")
 
+    # Poll again while jobs are pending, once the rest of the page has rendered
+    if pending:
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
+
 # This makes sure it runs if executed directly
 if __name__ == "__main__":
     app_financial()
@@ -0,0 +1,56 @@
+import resources
+resources.apply_environment()  # before torch/cv2 load their thread pools
+
+import os
+import cv2
+from functools import lru_cache
+from ultralytics import YOLO
+
+# Output directory for extracted tables
+OUTPUT_DIR = "output_images"
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# YOLO weights are loaded once per process and reused between calls
+@lru_cache(maxsize=1)
+def load_yolo(weights='best.pt'):
+    return YOLO(weights)  # Replace with the relative path if needed
+
+# YOLO table detection function
+def extract_tables(image_path, output_dir=OUTPUT_DIR, page_index=0, prefix=""):
+    return extract_tables_batch([image_path], output_dir, [page_index], [prefix])[0]
+
+# Runs YOLO once on several pages, returns the extracted table paths of each page.
+# Pages of different documents share a batch, so each page gets its own file name prefix.
+def extract_tables_batch(image_paths, output_dir=OUTPUT_DIR, page_indices=None, prefixes=None):
+    resources.configure_threads("detection")
+    model = load_yolo()
+    page_indices = page_indices if page_indices is not None else list(range(len(image_paths)))
+    prefixes = prefixes if prefixes is not None else [""] * len(image_paths)
+
+    imgs = []
+    for image_path in image_paths:
+        img = cv2.imread(image_path)
+        if img is None:
+            raise ValueError(f"Failed to read image: {image_path}")
+        imgs.append(img)
+
+    # One result per page, file names keep the single-image layout (table_0_<j>)
+    results = model(imgs)
+    all_paths = []
+
+    for img, result, page_index, prefix in zip(imgs, results, page_indices, prefixes):
+        h, w = img.shape[:2]
+        extracted_paths = []
+        boxes = result.boxes.xyxy.cpu().numpy()
+        confidences = result.boxes.conf.cpu().numpy()
+        for j, (box, conf) in enumerate(zip(boxes, confidences)):
+            if conf > 0.7:
+                x1, y1, x2, y2 = map(int, box)
+                x1, y1 = max(0, x1 - 10), max(0, y1 - 10)
+                x2, y2 = min(w, x2 + 10), min(h, y2 + 10)
+                roi = img[y1:y2, x1:x2]
+                output_path = os.path.join(output_dir, f"{prefix}page_{page_index}_table_0_{j}.png")
+                if cv2.imwrite(output_path, roi):
+                    extracted_paths.append(output_path)
+        all_paths.append(extracted_paths)
+    return all_paths
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import urllib.request
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import resources
+
+# Long-lived inference server: concurrent "Predict Labels" requests are gathered over a
+# short window and run as one padded LayoutLMv3 (or YOLO) batch, each caller receiving
+# its own result.
+
+INFERENCE_URL = os.environ.get("INFERENCE_URL", "http://127.0.0.1:8765")
+MAX_BATCH_SIZE = 8
+MAX_WAIT_MS = 20
+REQUEST_TIMEOUT = 300
+
+
+class MicroBatcher:
+    """Collect single requests and run them through a batch function.
+
+    The first request of a batch waits at most max_wait seconds for others to join,
+    so a lone request pays at most that much extra latency. If a batch fails, its
+    items are retried one by one so a bad item only fails its own caller.
+
+    Args:
+        batch_fn (callable): Takes a list of items and returns one result per item.
+        max_batch_size (int): Largest number of items per batch.
+        max_wait (float): Longest time, in seconds, a batch stays open.
+        lock (threading.Lock): Held while batch_fn runs, shared by batchers whose
+            stages must not run at the same time (e.g. process-wide torch threads).
+    """
+
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_WAIT_MS / 1000, lock=None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.lock = lock or threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future resolved with its own result."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=REQUEST_TIMEOUT):
+        return self.submit(item).result(timeout=timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _call(self, items):
+        with self.lock:
+            results = self.batch_fn(items)
+        if len(results) != len(items):
+            raise RuntimeError(f"Batch function returned {len(results)} results for {len(items)} items")
+        return results
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self._call([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                logging.warning(f"Batch of {len(batch)} failed ({str(e)}), retrying items one by one")
+                for item, future in batch:
+                    try:
+                        future.set_result(self._call([item])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def _layout_batch(image_paths):
+    # Runs under the stage lock: PaddleOCR predictors are not safe to share between threads
+    from PIL import Image
+    from predict import run_ocr, predict_batch
+
+    images = [Image.open(image_path).convert("RGB") for image_path in image_paths]
+    words_list, boxes_list = zip(*(run_ocr(image) for image in images))
+    return predict_batch(images, list(words_list), list(boxes_list))
+
+
+def _detection_batch(items):
+    from detect import extract_tables_batch
+
+    image_paths, page_indices, prefixes = zip(*items)
+    return extract_tables_batch(list(image_paths), page_indices=list(page_indices), prefixes=list(prefixes))
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    layout_batcher = None
+    detection_batcher = None
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/predict":
+                body = self._predict(payload)
+            elif self.path == "/detect":
+                item = (payload["image_path"], payload.get("page_index", 0), payload.get("prefix", ""))
+                body = {"tables": self.detection_batcher(item)}
+            else:
+                self.send_error(404, f"Unknown endpoint {self.path}")
+                return
+            self._send_json(200, body)
+        except Exception as e:
+            logging.error(f"Request {self.path} failed: {str(e)}")
+            self._send_json(500, {"error": str(e)})
+
+    def _predict(self, payload):
+        from predict import word_table_to_json
+
+        result = self.layout_batcher(payload["image_path"])
+        return {
+            "tokens": word_table_to_json(result["tokens"]),
+            "df": result["df"].to_dict(orient="split"),
+        }
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve(host="127.0.0.1", port=8765, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+    """Load the models and serve /predict and /detect until interrupted.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port to bind.
+        max_batch_size (int): Largest number of requests per forward pass.
+        max_wait_ms (float): Longest time a request waits for others to join its batch.
+    """
+    resources.apply_environment()
+    from predict import load_models
+    from detect import load_yolo
+    load_models()
+    load_yolo()
+
+    # torch thread counts are process-wide: one stage runs at a time with its own budget
+    stage_lock = threading.Lock()
+    InferenceHandler.layout_batcher = MicroBatcher(_layout_batch, max_batch_size, max_wait_ms / 1000, stage_lock)
+    InferenceHandler.detection_batcher = MicroBatcher(_detection_batch, max_batch_size, max_wait_ms / 1000, stage_lock)
+
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    print(f"Inference server on http://{host}:{port} (max batch {max_batch_size}, max wait {max_wait_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def _post(endpoint, payload, url=INFERENCE_URL, timeout=300):
+    request = urllib.request.Request(
+        f"{url}{endpoint}", data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def predict_remote(image_path, url=INFERENCE_URL):
+    """Same output as predict.predict_labels, computed by the inference server.
+
+    Raises:
+        OSError: If the server cannot be reached or the request fails.
+    """
+    import pandas as pd
+    from PIL import Image
+    from predict import word_table_from_json
+
+    body = _post("/predict", {"image_path": os.path.abspath(image_path)}, url)
+    return {
+        "image": Image.open(image_path).convert("RGB"),
+        "tokens": word_table_from_json(body["tokens"]),
+        "df": pd.DataFrame(**body["df"]),
+    }
+
+
+def detect_remote(image_path, page_index=0, prefix="", url=INFERENCE_URL):
+    """Same output as detect.extract_tables, computed by the inference server.
+
+    Raises:
+        OSError: If the server cannot be reached or the request fails.
+    """
+    payload = {"image_path": os.path.abspath(image_path), "page_index": page_index, "prefix": prefix}
+    body = _post("/detect", payload, url)
+    return body["tables"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-batching inference server for LayoutLMv3 and YOLO")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_batch_size, args.max_wait_ms)
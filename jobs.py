@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+import threading
+from contextlib import closing
+import multiprocessing as mp
+import resources
+
+# Local job queue: Streamlit pages submit work to a SQLite table and poll it, a pool of
+# long-lived worker processes (`python jobs.py`) keeps YOLO / LayoutLMv3 / PaddleOCR in
+# memory and runs the jobs. No external broker is needed.
+
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.db")
+JOBS_DIR = "jobs"
+os.makedirs(JOBS_DIR, exist_ok=True)
+POLL_INTERVAL = 0.5
+HEARTBEAT_TIMEOUT = 120
+# A job whose worker died this many times is marked failed instead of queued again
+MAX_ATTEMPTS = 3
+# Finished jobs (and leftover files in JOBS_DIR) are deleted after this many seconds
+JOB_RETENTION = 24 * 3600
+SUPERVISE_INTERVAL = 5
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def connect(db_path=JOBS_DB):
+    """Open the queue database, creating the tables on first use.
+
+    Args:
+        db_path (str): Path to the SQLite file.
+
+    Returns:
+        sqlite3.Connection: Connection with rows returned as sqlite3.Row.
+    """
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            worker_pid INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS workers (
+            pid INTEGER PRIMARY KEY,
+            heartbeat REAL NOT NULL
+        )""")
+    return conn
+
+
+def submit_job(kind, payload, db_path=JOBS_DB):
+    """Add a job to the queue.
+
+    Args:
+        kind (str): Job type, one of HANDLERS.
+        payload (dict): JSON-serialisable job arguments.
+        db_path (str): Path to the SQLite file.
+
+    Returns:
+        str: Identifier of the new job.
+
+    Raises:
+        ValueError: If the job type is unknown.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'. Available kinds: {list(HANDLERS)}")
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with closing(connect(db_path)) as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), QUEUED, now, now)
+        )
+    return job_id
+
+
+def get_jobs(job_ids, db_path=JOBS_DB):
+    """Fetch the status and result of several jobs.
+
+    Args:
+        job_ids (list): Job identifiers returned by submit_job.
+        db_path (str): Path to the SQLite file.
+
+    Returns:
+        dict: Mapping of job id to {'status', 'result', 'error'}, in submission order.
+        Ids no longer in the queue (pruned) are reported as failed.
+    """
+    if not job_ids:
+        return {}
+    placeholders = ",".join("?" * len(job_ids))
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            f"SELECT id, status, result, error FROM jobs WHERE id IN ({placeholders})", list(job_ids)
+        ).fetchall()
+
+    by_id = {
+        row["id"]: {
+            "status": row["status"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+        }
+        for row in rows
+    }
+    expired = {"status": FAILED, "result": None, "error": "Job expired or unknown"}
+    return {job_id: by_id.get(job_id, expired) for job_id in job_ids}
+
+
+def active_workers(db_path=JOBS_DB):
+    """Count worker processes that sent a heartbeat recently.
+
+    Args:
+        db_path (str): Path to the SQLite file.
+
+    Returns:
+        int: Number of live workers.
+    """
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM workers WHERE heartbeat > ?", (time.time() - HEARTBEAT_TIMEOUT,)
+        ).fetchone()
+    return row[0]
+
+
+def claim_job(conn, pid):
+    """Atomically move the oldest queued job to the running state.
+
+    Args:
+        conn (sqlite3.Connection): Connection returned by connect().
+        pid (int): Process id of the claiming worker.
+
+    Returns:
+        sqlite3.Row or None: The claimed job, or None if the queue is empty.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_pid = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, pid, time.time(), row["id"])
+            )
+        conn.execute("COMMIT")
+        return row
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def requeue_orphaned_jobs(conn, dead_pids=()):
+    """Queue again the running jobs whose worker died or stopped sending heartbeats.
+
+    Jobs that already used MAX_ATTEMPTS attempts are marked failed instead.
+
+    Args:
+        conn (sqlite3.Connection): Connection returned by connect().
+        dead_pids (iterable): Workers known to have exited, requeued without waiting
+            for their heartbeat to expire.
+
+    Returns:
+        int: Number of jobs requeued or failed.
+    """
+    dead_pids = list(dead_pids)
+    stale = time.time() - HEARTBEAT_TIMEOUT
+    orphaned = (
+        "status = ? AND (worker_pid IS NULL"
+        " OR worker_pid NOT IN (SELECT pid FROM workers WHERE heartbeat > ?)"
+        f" OR worker_pid IN ({','.join('?' * len(dead_pids)) or 'NULL'}))"
+    )
+    params = [RUNNING, stale, *dead_pids]
+    now = time.time()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        failed = conn.execute(
+            f"UPDATE jobs SET status = ?, error = ?, worker_pid = NULL, updated_at = ? WHERE {orphaned} AND attempts >= ?",
+            [FAILED, f"Worker died {MAX_ATTEMPTS} times while running this job", now, *params, MAX_ATTEMPTS]
+        ).rowcount
+        requeued = conn.execute(
+            f"UPDATE jobs SET status = ?, worker_pid = NULL, updated_at = ? WHERE {orphaned}",
+            [QUEUED, now, *params]
+        ).rowcount
+        conn.execute(
+            f"DELETE FROM workers WHERE heartbeat <= ? OR pid IN ({','.join('?' * len(dead_pids)) or 'NULL'})",
+            [stale, *dead_pids]
+        )
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+    if failed or requeued:
+        logging.warning(f"Recovered orphaned jobs: {requeued} requeued, {failed} failed")
+    return failed + requeued
+
+
+def prune_jobs(conn, retention=JOB_RETENTION):
+    """Delete finished jobs and leftover files in JOBS_DIR older than retention seconds.
+
+    Args:
+        conn (sqlite3.Connection): Connection returned by connect().
+        retention (float): Age in seconds after which finished jobs are deleted.
+
+    Returns:
+        int: Number of jobs deleted.
+    """
+    cutoff = time.time() - retention
+    deleted = conn.execute(
+        "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff)
+    ).rowcount
+
+    for name in os.listdir(JOBS_DIR):
+        path = os.path.join(JOBS_DIR, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+        except OSError as e:
+            logging.error(f"Could not remove {path}: {str(e)}")
+    return deleted
+
+
+def finish_job(conn, job_id, pid, result=None, error=None):
+    # Ignored if the job was meanwhile requeued and claimed by another worker
+    status = FAILED if error is not None else DONE
+    conn.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ? AND worker_pid = ?",
+        (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, pid)
+    )
+
+
+def run_detect_page(payload):
+    """Convert one PDF page to an image and extract its tables with YOLO."""
+    from pdf2image import convert_from_path
+    from inference_server import detect_remote
+
+    page_index = payload["page_index"]
+    images = convert_from_path(payload["pdf_path"], first_page=page_index + 1, last_page=page_index + 1)
+    if not images:
+        raise ValueError(f"Page {page_index + 1} not found in {payload['pdf_path']}")
+
+    page_path = os.path.join(JOBS_DIR, f"{uuid.uuid4().hex}_page_{page_index}.png")
+    images[0].save(page_path, format="PNG")
+    prefix = payload.get("prefix", "")
+    try:
+        try:
+            # Pages from concurrent workers are batched together by the inference server
+            tables = detect_remote(page_path, page_index, prefix)
+        except OSError:
+            from detect import extract_tables
+            tables = extract_tables(page_path, page_index=page_index, prefix=prefix)
+    finally:
+        os.unlink(page_path)
+    return {"page_index": page_index, "tables": tables}
+
+
+def run_predict(payload):
+    """Run OCR + LayoutLMv3 on a table crop and return the extracted rows."""
+    from predict import predict_labels
+
+    result = predict_labels(payload["image_path"])
+    return {"df": result["df"].to_dict(orient="split")}
+
+
+HANDLERS = {
+    "detect_page": run_detect_page,
+    "predict": run_predict,
+}
+
+
+def _heartbeat(pid, db_path, stop):
+    # Separate thread and connection, so long jobs (e.g. the first model download)
+    # keep the worker visible to active_workers()
+    with closing(connect(db_path)) as conn:
+        while not stop.is_set():
+            conn.execute("INSERT OR REPLACE INTO workers (pid, heartbeat) VALUES (?, ?)", (pid, time.time()))
+            stop.wait(HEARTBEAT_TIMEOUT / 3)
+
+
+def worker_loop(worker_index, workers, db_path=JOBS_DB):
+    """Run jobs from the queue until the process is stopped.
+
+    Args:
+        worker_index (int): Index of the worker, used for CPU affinity.
+        workers (int): Size of the pool, used to split the cores between workers.
+        db_path (str): Path to the SQLite file.
+    """
+    # The pool may be larger or smaller than resources.json says (--workers)
+    resources.load_resource_config(reload=True, workers=workers)
+    resources.set_worker_affinity(worker_index, workers)
+    resources.apply_environment()
+    conn = connect(db_path)
+    pid = os.getpid()
+    threading.Thread(target=_heartbeat, args=(pid, db_path, threading.Event()), daemon=True).start()
+
+    while True:
+        job = claim_job(conn, pid)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        try:
+            result = HANDLERS[job["kind"]](json.loads(job["payload"]))
+            finish_job(conn, job["id"], pid, result=result)
+        except Exception as e:
+            logging.error(f"Job {job['id']} ({job['kind']}) failed: {str(e)}")
+            finish_job(conn, job["id"], pid, error=str(e))
+
+
+def serve(workers=None, db_path=JOBS_DB):
+    """Start the worker pool and supervise it until interrupted.
+
+    Jobs left running by a previous service (e.g. after a crash) are queued again.
+    While running, dead workers are restarted, jobs of dead or silent workers are
+    queued again, and old finished jobs are pruned.
+
+    Args:
+        workers (int): Number of worker processes (default: resources configuration).
+        db_path (str): Path to the SQLite file.
+    """
+    workers = workers or resources.load_resource_config()["workers"]
+    with closing(connect(db_path)) as conn:
+        conn.execute("UPDATE jobs SET status = ?, worker_pid = NULL WHERE status = ?", (QUEUED, RUNNING))
+        conn.execute("DELETE FROM workers")
+
+    ctx = mp.get_context("spawn")
+
+    def start_worker(i):
+        p = ctx.Process(target=worker_loop, args=(i, workers, db_path), daemon=True)
+        p.start()
+        return p
+
+    processes = [start_worker(i) for i in range(workers)]
+    print(f"Job service running with {workers} worker(s) on {db_path}")
+    try:
+        with closing(connect(db_path)) as conn:
+            while True:
+                time.sleep(SUPERVISE_INTERVAL)
+                dead = [(i, p) for i, p in enumerate(processes) if not p.is_alive()]
+                for i, p in dead:
+                    logging.error(f"Worker {i} (pid {p.pid}) exited with code {p.exitcode}, restarting")
+                    processes[i] = start_worker(i)
+                requeue_orphaned_jobs(conn, [p.pid for _, p in dead])
+                prune_jobs(conn)
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local job queue for table detection and label prediction")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--db", default=JOBS_DB)
+    args = parser.parse_args()
+    serve(workers=args.workers, db_path=args.db)
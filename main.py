@@ -1,10 +1,14 @@
+import resources
+resources.apply_environment()  # before torch/paddle/cv2 load their thread pools
+
 import streamlit as st
 from pdf2image import convert_from_bytes
-from ultralytics import YOLO
-import tempfile
+import time
+import uuid
+import hashlib
 import os
-import cv2
 from PIL import Image
+from jobs import submit_job, get_jobs, active_workers, JOBS_DIR, POLL_INTERVAL, DONE, FAILED
 from predict import predict_labels
 from app import app_main
 from dashboard_financial import app_financial
@@ -18,30 +22,6 @@ page = st.sidebar.radio("Go to:", ["Main", "App", "Financial Dashboard"])
 OUTPUT_DIR = "output_images"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# YOLO table detection function
-def extract_tables(image_path, output_dir=OUTPUT_DIR, page_index=0):
-    model = YOLO('best.pt')  # Replace with the relative path if needed
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Failed to read image: {image_path}")
-    h, w = img.shape[:2]
-    results = model(img)
-    extracted_paths = []
-
-    for i, result in enumerate(results):
-        boxes = result.boxes.xyxy.cpu().numpy()
-        confidences = result.boxes.conf.cpu().numpy()
-        for j, (box, conf) in enumerate(zip(boxes, confidences)):
-            if conf > 0.7:
-                x1, y1, x2, y2 = map(int, box)
-                x1, y1 = max(0, x1 - 10), max(0, y1 - 10)
-                x2, y2 = min(w, x2 + 10), min(h, y2 + 10)
-                roi = img[y1:y2, x1:x2]
-                output_path = os.path.join(output_dir, f"page_{page_index}_table_{i}_{j}.png")
-                if cv2.imwrite(output_path, roi):
-                    extracted_paths.append(output_path)
-    return extracted_paths
-
 # PAGE 1: MAIN
 if page == "Main":
     st.title("📄 Balance Sheet Detection from PDF Report")
@@ -50,7 +30,12 @@ if page == "Main":
     if uploaded_pdf:
         st.success("✅ PDF successfully uploaded!")
         try:
-            images = convert_from_bytes(uploaded_pdf.read(), first_page=1, last_page=4)
+            # Rasterized once per upload, not on every poll rerun
+            upload_key = hashlib.sha1(uploaded_pdf.getvalue()).hexdigest()
+            if st.session_state.get("preview_key") != upload_key:
+                st.session_state.preview_images = convert_from_bytes(uploaded_pdf.getvalue(), first_page=1, last_page=4)
+                st.session_state.preview_key = upload_key
+            images = st.session_state.preview_images
             st.subheader("🖼️ Extracted Pages")
             cols = st.columns(min(len(images), 5))
             for i, img in enumerate(images):
@@ -58,14 +43,26 @@ if page == "Main":
                     st.image(img, caption=f"Page {i+1}", width=160)
 
             if st.button("🚀 Run YOLOv11 Table Detection"):
+                # The PDF is kept on disk for the workers, one job per page
+                pdf_path = os.path.join(JOBS_DIR, f"{uuid.uuid4().hex}.pdf")
+                with open(pdf_path, "wb") as f:
+                    f.write(uploaded_pdf.getvalue())
+                st.session_state.detection_pdf = pdf_path
+                st.session_state.detection_jobs = [
+                    submit_job("detect_page", {"pdf_path": pdf_path, "page_index": i, "prefix": f"{upload_key[:8]}_"})
+                    for i in range(len(images))
+                ]
+
+            if "detection_jobs" in st.session_state:
                 st.subheader("📍 Detection Results")
-                for i, img in enumerate(images):
-                    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                        img.save(tmp.name, format="PNG")
-                        tmp_path = tmp.name
+                if not active_workers():
+                    st.info("⏳ No job worker running. Start one with `python jobs.py`.")
 
-                    try:
-                        extracted = extract_tables(tmp_path, page_index=i)
+                jobs = get_jobs(st.session_state.detection_jobs)
+                pending = 0
+                for i, job in enumerate(jobs.values()):
+                    if job["status"] == DONE:
+                        extracted = job["result"]["tables"]
                         if extracted:
                             st.markdown(f"**📑 Page {i+1} - Extracted Tables:**")
                             cols_tables = st.columns(min(len(extracted), 4))
@@ -74,11 +71,18 @@ if page == "Main":
                                     st.image(table_path, caption=f"Table {k+1}", width=280)
                         else:
                             st.warning(f"No table detected on page {i+1}.")
-                    except Exception as e:
-                        st.error(f"Error on page {i+1}: {e}")
-                    finally:
-                        if os.path.exists(tmp_path):
-                            os.unlink(tmp_path)
+                    elif job["status"] == FAILED:
+                        st.error(f"Error on page {i+1}: {job['error']}")
+                    else:
+                        pending += 1
+                        st.info(f"Page {i+1}: {job['status']}...")
+
+                if pending:
+                    time.sleep(POLL_INTERVAL)
+                    st.rerun()
+                elif os.path.exists(st.session_state.get("detection_pdf", "")):
+                    # Every page job has finished, the workers no longer need the PDF
+                    os.unlink(st.session_state.detection_pdf)
         except Exception as e:
             st.error(f"Error processing the PDF: {e}")
 # PAGE 2: APP 
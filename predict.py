@@ -1,3 +1,6 @@
+import resources
+resources.apply_environment()  # before torch/paddle load their thread pools
+
 from transformers import LayoutLMv3Processor, AutoModelForTokenClassification
 from paddleocr import PaddleOCR
 from PIL import Image
@@ -8,14 +11,56 @@ import pandas as pd
 import zipfile
 import os
 import gdown
+from functools import lru_cache
+
+# Boxes from the 0-1000 LayoutLMv3 scale back to pixels, over an (n, 4) array
+def unnormalize_boxes(boxes, width, height):
+    boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    return (boxes / 1000 * np.array([width, height, width, height])).astype(int)
+
+def build_word_table(words, predictions, token_boxes, word_ids, id2label, width, height):
+    """Columnar view of a prediction: NumPy arrays instead of one dict per token.
+
+    Token-level arrays (token_label_ids, token_boxes) cover every token, for drawing.
+    Word-level arrays keep the first sub-token of each word, in reading order.
+    """
+    label_names = np.array([id2label[i].lower() for i in range(len(id2label))])
+    token_label_ids = np.asarray(predictions, dtype=int)
+    token_boxes = unnormalize_boxes(token_boxes, width, height)
+    token_word_ids = np.array([-1 if wid is None else wid for wid in word_ids], dtype=int)
+
+    # np.unique returns the first occurrence of each word id
+    word_ids_unique, first_token = np.unique(token_word_ids, return_index=True)
+    keep = word_ids_unique >= 0
+    word_ids_unique, first_token = word_ids_unique[keep], first_token[keep]
+
+    return {
+        "label_names": label_names,
+        "token_label_ids": token_label_ids,
+        "token_boxes": token_boxes,
+        "word_ids": word_ids_unique,
+        "texts": np.asarray(words, dtype=object)[word_ids_unique],
+        "label_ids": token_label_ids[first_token],
+        "boxes": token_boxes[first_token],
+    }
+
+# Numeric arrays of a word table, the others (label_names, texts) hold strings
+WORD_TABLE_INT_FIELDS = ("token_label_ids", "token_boxes", "word_ids", "label_ids", "boxes")
+
+def word_table_to_json(table):
+    return {name: array.tolist() for name, array in table.items()}
+
+def word_table_from_json(data):
+    table = {name: np.array(data[name], dtype=int) for name in WORD_TABLE_INT_FIELDS}
+    table["token_boxes"] = table["token_boxes"].reshape(-1, 4)
+    table["boxes"] = table["boxes"].reshape(-1, 4)
+    table["label_names"] = np.array(data["label_names"], dtype=str)
+    table["texts"] = np.array(data["texts"], dtype=object)
+    return table
+
+def label_mask(table, label):
+    return np.isin(table["label_ids"], np.flatnonzero(table["label_names"] == label))
 
-def unnormalize_box(box, width, height):
-    return [
-        int(box[0] / 1000 * width),
-        int(box[1] / 1000 * height),
-        int(box[2] / 1000 * width),
-        int(box[3] / 1000 * height)
-    ]
 def extract_year(text):
     text = text.lower().replace('–', '-')
 
@@ -68,17 +113,23 @@ def download_model():
             gdown.download(url, dest, quiet=False)
 
     return model_dir
-def predict_labels(image_path):
+# Loaded once per process and kept in memory (long-lived workers reuse them between jobs)
+@lru_cache(maxsize=1)
+def load_models():
     model_path = download_model()
     processor = LayoutLMv3Processor.from_pretrained(model_path)
     model = AutoModelForTokenClassification.from_pretrained(model_path)
-        
+    model.eval()
+    ocr = PaddleOCR(use_angle_cls=False, lang='fr', rec=False,
+                    cpu_threads=resources.stage_threads("ocr")["paddle"])
+    return processor, model, ocr
 
-    image = Image.open(image_path).convert("RGB")
+def run_ocr(image):
+    _, _, ocr = load_models()
     image_np = np.array(image)
     h, w = image_np.shape[:2]
 
-    ocr = PaddleOCR(use_angle_cls=False, lang='fr', rec=False)
+    resources.configure_threads("ocr")
     result = ocr.ocr(image_np, cls=False)
 
     words = []
@@ -102,90 +153,83 @@ def predict_labels(image_path):
         ]
         boxes.append(norm_box)
 
-    encoding = processor(images=image, text=words, boxes=boxes, return_tensors="pt", truncation=True)
+    return words, boxes
+
+# One padded LayoutLMv3 forward pass for several crops, each already OCR'd
+def predict_batch(images, words_list, boxes_list):
+    processor, model, _ = load_models()
+    encoding = processor(images=images, text=words_list, boxes=boxes_list,
+                         return_tensors="pt", truncation=True, padding=True)
 
+    resources.configure_threads("layout")
     with torch.no_grad():
         outputs = model(**encoding)
 
-    logits = outputs.logits
-    predictions = logits.argmax(-1).squeeze().tolist()
-    token_boxes = encoding.bbox.squeeze().tolist()
+    all_predictions = outputs.logits.argmax(-1).tolist()
+    all_token_boxes = encoding.bbox.tolist()
+    lengths = encoding.attention_mask.sum(-1).tolist()
 
-    true_predictions = [model.config.id2label[pred] for pred in predictions]
-    true_boxes = [unnormalize_box(box, w, h) for box in token_boxes]
+    results = []
+    for i, (image, words) in enumerate(zip(images, words_list)):
+        # Padding tokens (right side) are dropped before decoding
+        n = lengths[i]
+        results.append(decode_predictions(
+            image, words,
+            all_predictions[i][:n], all_token_boxes[i][:n], encoding.word_ids(i)[:n],
+            model.config.id2label
+        ))
+    return results
 
-    tokens = processor.tokenizer.convert_ids_to_tokens(encoding.input_ids.squeeze())
-    word_ids = encoding.word_ids()
+def predict_labels(image_path):
+    image = Image.open(image_path).convert("RGB")
+    words, boxes = run_ocr(image)
+    return predict_batch([image], [words], [boxes])[0]
 
-    results = []
-    for idx, (pred, box) in enumerate(zip(predictions, token_boxes)):
-        label = model.config.id2label[pred]
-        if word_ids[idx] is None:
-            continue
-        word = words[word_ids[idx]]
-        results.append({
-            'text': word,
-            'label': label.lower(),
-            'box': unnormalize_box(box, w, h)
-        })
-
-    unique_results = []
-    seen = set()
-    for item in results:
-        key = (item['text'], item['label'], tuple(item['box']))
-        if key not in seen:
-            seen.add(key)
-            unique_results.append(item)
-
-    name_items = [item for item in unique_results if item['label'] == 'name']
-    year_items = [item for item in unique_results if item['label'] == 'year']
-    reference_items = [item for item in unique_results if item['label'] == 'reference']
-    key_items = sorted([item for item in unique_results if item['label'] == 'key'], key=lambda x: x['box'][1])
-    value_items = [item for item in unique_results if item['label'] == 'value']
+def decode_predictions(image, words, predictions, token_boxes, word_ids, id2label):
+    w, h = image.size
+    table = build_word_table(words, predictions, token_boxes, word_ids, id2label, w, h)
+    return {
+        "image": image,
+        "tokens": table,
+        "df": table_to_dataframe(table)
+    }
+
+# Lay the words out as a balance sheet: one row per key, one column per detected year.
+# parse_year turns the text of a 'year' word into a year string, or None.
+def table_to_dataframe(table, parse_year=extract_year):
+    texts = table["texts"]
+    boxes = table["boxes"]
 
     year_positions = {}
-    for item in year_items:
-        year = extract_year(item['text'])
+    is_year = label_mask(table, 'year')
+    for text, box in zip(texts[is_year], boxes[is_year]):
+        year = parse_year(text)
         if year and year not in year_positions:
-            year_positions[year] = item['box'][0]
-            print(f"Année détectée : {year}, Position x : {item['box'][0]}")
+            year_positions[year] = int(box[0])
+            print(f"Année détectée : {year}, Position x : {box[0]}")
+
+    key_idx = np.flatnonzero(label_mask(table, 'key'))
+    key_idx = key_idx[np.argsort(boxes[key_idx, 1], kind='stable')]
+    value_idx = np.flatnonzero(label_mask(table, 'value'))
 
     data = []
-    for key_item in key_items:
-        key_text = key_item['text']
-        key_box = key_item['box']
-        key_y_min = key_box[1]
-
-        note = ''
-        for name_item in name_items:
-            if 'CP-' in name_item['text'] or 'p-' in name_item['text']:
-                name_y_min = name_item['box'][1]
-                if abs(name_y_min - key_y_min) < 10:
-                    note = name_item['text']
-                    break
+    for k in key_idx:
+        key_y_min = boxes[k, 1]
 
         year_values = {}
-        for value_item in value_items:
-            value_box = value_item['box']
-            value_y_min = value_box[1]
-            if abs(value_y_min - key_y_min) < 10:
-                for year, x_pos in year_positions.items():
-                    if abs(value_box[0] - x_pos) < 50:
-                        value = value_item['text'].replace(' ', '').replace(',', '.')
-                        year_values[year] = value
-                        break
+        same_row = value_idx[np.abs(boxes[value_idx, 1] - key_y_min) < 10]
+        for v in same_row:
+            for year, x_pos in year_positions.items():
+                if abs(boxes[v, 0] - x_pos) < 50:
+                    value = texts[v].replace(' ', '').replace(',', '.')
+                    year_values[year] = value
+                    break
 
         row = {
-            'key': key_text
+            'key': texts[k]
         }
         for year in sorted(year_positions.keys(), reverse=True):
             row[year] = year_values.get(year, 0)
         data.append(row)
 
-    df = pd.DataFrame(data)
-    return {
-        "image": image,
-        "true_predictions": true_predictions,
-        "true_boxes": true_boxes,
-        "df": df
-    }
+    return pd.DataFrame(data)
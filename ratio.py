@@ -1,11 +1,28 @@
+import numpy as np
 import pandas as pd
+import os
+import json
 import logging
 import re
+from functools import lru_cache
 from difflib import SequenceMatcher
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Declarative ratio definitions shared by the dashboard and the bulk ratio engine
+RATIO_SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ratios.json")
+
+# Functions accepted by DataFrame.eval in ratio expressions
+EVAL_FUNCTIONS = {
+    'abs', 'sqrt', 'exp', 'expm1', 'log', 'log1p', 'log10', 'floor', 'ceil',
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2',
+    'sinh', 'cosh', 'tanh', 'arcsinh', 'arccosh', 'arctanh'
+}
+
+# Identifier, followed by "(" when it is a function call
+IDENTIFIER = re.compile(r'\b([A-Za-z_]\w*)\b(\s*\()?')
+
 def similar(a, b, threshold=0.8):
     """Calculate similarity ratio between two strings.
 
@@ -126,6 +143,163 @@ def select_key(df, key_column='Key'):
 
     return select_key_for_year(df, year_columns[0], key_column)
 
+def expression_metrics(expression):
+    """Return the metric names referenced by a ratio expression.
+
+    Args:
+        expression (str): Arithmetic over metric names, e.g. "abs(resultat_net) / revenus".
+
+    Returns:
+        set: Metric names, function names excluded.
+
+    Raises:
+        ValueError: If the expression calls a function DataFrame.eval does not support.
+    """
+    metrics = set()
+    for name, call in IDENTIFIER.findall(expression or ''):
+        if not call:
+            metrics.add(name)
+        elif name not in EVAL_FUNCTIONS:
+            raise ValueError(f"Unsupported function '{name}' in '{expression}'. Supported: {sorted(EVAL_FUNCTIONS)}")
+    return metrics
+
+def spec_metrics(spec):
+    """Return the metric names referenced by a ratio spec.
+
+    Args:
+        spec (dict): Ratio definitions.
+
+    Returns:
+        list: Sorted metric names.
+    """
+    names = set()
+    for definition in spec.values():
+        names |= expression_metrics(definition.get('numerator'))
+        names |= expression_metrics(definition.get('denominator'))
+    return sorted(names)
+
+@lru_cache(maxsize=None)
+def load_ratio_spec(path=RATIO_SPEC_PATH):
+    """Load ratio definitions from a JSON file (cached per path, treat as read-only).
+
+    Each entry maps a ratio name to {"numerator": expr, "denominator": expr}, where the
+    expressions are arithmetic over metric names (e.g. "actifs_courants - stocks").
+    The denominator is optional.
+
+    Args:
+        path (str): Path to the JSON spec.
+
+    Returns:
+        dict: Ratio definitions.
+
+    Raises:
+        ValueError: If a definition has no numerator or uses an unsupported function.
+    """
+    with open(path, encoding='utf-8') as f:
+        spec = json.load(f)
+
+    for name, definition in spec.items():
+        if not definition.get('numerator'):
+            raise ValueError(f"Ratio '{name}' has no numerator")
+    spec_metrics(spec)
+    return spec
+
+def evaluate_wide(wide, spec):
+    """Evaluate every ratio of the spec on a wide table of metrics, one row per entity.
+
+    Missing metrics give NaN. A zero denominator gives NaN rather than inf; the number
+    of such rows is logged per ratio.
+
+    Args:
+        wide (pd.DataFrame): One column per metric, numeric values.
+        spec (dict): Ratio definitions.
+
+    Returns:
+        pd.DataFrame: Same index as wide, one column per ratio.
+    """
+    # Metrics never reported still need a column for the expressions
+    wide = wide.reindex(columns=wide.columns.union(spec_metrics(spec)))
+
+    ratios = pd.DataFrame(index=wide.index)
+    for name, definition in spec.items():
+        numerator = wide.eval(definition['numerator'])
+        if not definition.get('denominator'):
+            ratios[name] = numerator
+            continue
+
+        denominator = wide.eval(definition['denominator'])
+        zero = denominator == 0
+        if zero.any():
+            logging.warning(f"{int(zero.sum())} zero denominator(s) for ratio '{name}'")
+        ratios[name] = numerator / denominator.mask(zero, np.nan)
+    return ratios
+
+def compute_ratios_by_year(metrics_by_year, spec=None):
+    """Calculate financial ratios for several years in one vectorized pass.
+
+    A ratio is left out of a year when it cannot be computed (missing metric or
+    zero denominator).
+
+    Args:
+        metrics_by_year (dict): Year -> metrics as returned by select_key_for_year.
+        spec (dict): Ratio definitions (default: load_ratio_spec()).
+
+    Returns:
+        dict: Dictionary of ratios for each year.
+    """
+    spec = spec if spec is not None else load_ratio_spec()
+    if not metrics_by_year:
+        return {}
+
+    wide = pd.DataFrame.from_dict(metrics_by_year, orient='index', dtype=float)
+    ratios = evaluate_wide(wide, spec).replace([np.inf, -np.inf], np.nan)
+    return {
+        year: {name: float(value) for name, value in row.items() if pd.notna(value)}
+        for year, row in zip(metrics_by_year, ratios.to_dict(orient='records'))
+    }
+
+def compute_year_ratios(results, spec=None):
+    """Calculate financial ratios from the metrics of a single year.
+
+    Args:
+        results (dict): Metrics as returned by select_key_for_year.
+        spec (dict): Ratio definitions (default: load_ratio_spec()).
+
+    Returns:
+        dict: Ratios that could be computed from the available metrics.
+    """
+    return compute_ratios_by_year({0: results}, spec)[0]
+
+def update_ratios(state, df, key_column='Key'):
+    """Fold newly extracted rows into running per-year metrics and recompute only the affected years.
+
+    Later rows override earlier ones, as in a full calculate_ratios pass over the
+    concatenated DataFrame.
+
+    Args:
+        state (dict): Running state, updated in place. Start with an empty dict.
+        df (pd.DataFrame): New rows with a key column and year columns.
+        key_column (str): Name of the column containing metric keys (default: 'Key').
+
+    Returns:
+        dict: Dictionary of ratios for every year seen so far.
+    """
+    metrics = state.setdefault('metrics', {})
+    ratios = state.setdefault('ratios', {})
+
+    if df.empty or key_column not in df.columns:
+        logging.warning(f"No rows with key column '{key_column}' to add to ratios")
+        return ratios
+
+    year_columns = [col for col in df.columns if col not in [key_column, 'source_image']]
+    for year in year_columns:
+        results = select_key_for_year(df, year, key_column)
+        year_metrics = metrics.setdefault(year, dict.fromkeys(results))
+        year_metrics.update({k: v for k, v in results.items() if v is not None})
+    ratios.update(compute_ratios_by_year({year: metrics[year] for year in year_columns}))
+
+    return ratios
+
 def calculate_ratios(df, key_column='Key'):
     """Calculate financial ratios for each year in the DataFrame.
 
@@ -149,35 +323,14 @@ def calculate_ratios(df, key_column='Key'):
             logging.error(f"Key column '{key_column}' not found in DataFrame. Available columns: {list(df.columns)}")
             return {}
 
-        ratios = {}
         year_columns = [col for col in df.columns if col not in [key_column, 'source_image']]
 
         if not year_columns:
             logging.warning("No valid year columns found in DataFrame")
             return {}
 
-        for year in year_columns:
-            year_ratios = {}
-            results = select_key_for_year(df, year, key_column)
-
-            if results['actifs_courants'] and results['passifs_courants'] and results['passifs_courants'] != 0:
-                year_ratios['Ratio liquidité générale'] = results['actifs_courants'] / results['passifs_courants']
-            if results['actifs_courants'] and results['stocks'] and results['passifs_courants'] and results['passifs_courants'] != 0:
-                year_ratios['Ratio de liquidité immédiate'] = (results['actifs_courants'] - results['stocks']) / results['passifs_courants']
-            if results['resultat_net'] and results['revenus'] and results['revenus'] != 0:
-                year_ratios['Marge nette'] = results['resultat_net'] / results['revenus']
-            if results['resultat_net'] and results['total_actifs'] and results['total_actifs'] != 0:
-                year_ratios['Rentabilité économique'] = results['resultat_net'] / results['total_actifs']
-            if results['resultat_net'] and results['capitaux_propres'] and results['capitaux_propres'] != 0:
-                year_ratios['Rentabilité financière'] = results['resultat_net'] / results['capitaux_propres']
-            if results['total_passifs'] and results['capitaux_propres'] and results['capitaux_propres'] != 0:
-                year_ratios['Ratio d\'endettement'] = results['total_passifs'] / results['capitaux_propres']
-            if results['capitaux_propres'] and results['total_actifs'] and results['total_actifs'] != 0:
-                year_ratios['Ratio de solvabilité'] = results['capitaux_propres'] / results['total_actifs']
-
-            ratios[year] = year_ratios
-
-        return ratios
+        metrics_by_year = {year: select_key_for_year(df, year, key_column) for year in year_columns}
+        return compute_ratios_by_year(metrics_by_year)
 
     except (ValueError, KeyError) as e:
         logging.error(f"Error calculating ratios: {str(e)}")
@@ -0,0 +1,79 @@
+import argparse
+import pandas as pd
+from ratio import select_key_for_year, load_ratio_spec, evaluate_wide, RATIO_SPEC_PATH
+
+# Bulk ratio engine: evaluates declarative ratio definitions (ratios.json) over a long
+# table of (company, year, metric, value) rows, all company-years in one vectorized pass.
+# The spec and evaluation are the ones ratio.compute_year_ratios uses for the dashboard.
+
+
+def long_from_extracted(df, company, key_column='key'):
+    """Convert an extracted balance sheet (key column + year columns) to long format.
+
+    Metric names are resolved with the same key matching as select_key_for_year.
+
+    Args:
+        df (pd.DataFrame): DataFrame with a key column and year columns.
+        company (str): Company identifier to attach to every row.
+        key_column (str): Name of the column containing metric keys (default: 'key').
+
+    Returns:
+        pd.DataFrame: Columns company, year, metric, value.
+    """
+    year_columns = [col for col in df.columns if col not in [key_column, 'source_image']]
+    rows = []
+    for year in year_columns:
+        for metric, value in select_key_for_year(df, year, key_column).items():
+            if value is not None:
+                rows.append((company, year, metric, value))
+    return pd.DataFrame(rows, columns=['company', 'year', 'metric', 'value'])
+
+
+def evaluate_ratios(long_df, spec=None, company_col='company', year_col='year',
+                    metric_col='metric', value_col='value'):
+    """Evaluate every ratio of the spec for every company-year.
+
+    Missing metrics give NaN. A zero denominator gives NaN rather than inf; the number
+    of such company-years is logged per ratio. When a metric appears more than once
+    for a company-year, the last value wins.
+
+    Args:
+        long_df (pd.DataFrame): Long table of company, year, metric, value rows.
+        spec (dict): Ratio definitions (default: load_ratio_spec()).
+        company_col, year_col, metric_col, value_col (str): Column names in long_df.
+
+    Returns:
+        pd.DataFrame: One row per company-year, one column per ratio.
+
+    Raises:
+        KeyError: If one of the columns is not in long_df.
+        ValueError: If an expression calls a function DataFrame.eval does not support.
+    """
+    spec = spec if spec is not None else load_ratio_spec()
+
+    missing = [col for col in (company_col, year_col, metric_col, value_col) if col not in long_df.columns]
+    if missing:
+        raise KeyError(f"Columns {missing} not found in DataFrame. Available columns: {list(long_df.columns)}")
+
+    values = pd.to_numeric(long_df[value_col], errors='coerce')
+    wide = (
+        values.groupby([long_df[company_col], long_df[year_col], long_df[metric_col]]).last()
+        .unstack(metric_col)
+    )
+    ratios = evaluate_wide(wide, spec)
+    ratios.columns.name = None
+    return ratios.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate ratios over a long (company, year, metric, value) CSV")
+    parser.add_argument("input", help="CSV with company, year, metric and value columns")
+    parser.add_argument("--spec", default=RATIO_SPEC_PATH)
+    parser.add_argument("--output", default=None, help="CSV to write (default: print)")
+    args = parser.parse_args()
+
+    result = evaluate_ratios(pd.read_csv(args.input), load_ratio_spec(args.spec))
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(index=False))
@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import logging
+import argparse
+import multiprocessing as mp
+from queue import Empty
+
+# Thread budgets for the libraries sharing the process: YOLO and LayoutLMv3 (torch),
+# PaddleOCR (paddle) and OpenCV. Each one defaults to one thread per core, so running
+# them side by side (or in parallel workers) oversubscribes the machine.
+
+RESOURCE_CONFIG_PATH = os.environ.get("RESOURCE_CONFIG", "resources.json")
+
+STAGES = ("detection", "ocr", "layout")
+
+# Environment variables read by the OpenMP / BLAS runtimes when they are first loaded
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+_config = None
+
+
+def available_cpus():
+    """Return the list of CPUs this process may run on.
+
+    Returns:
+        list: CPU indices, honouring any affinity already set on the process.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def default_config(workers=1):
+    """Build a configuration that splits the available cores evenly between workers.
+
+    Args:
+        workers (int): Number of parallel worker processes sharing the machine.
+
+    Returns:
+        dict: Resource configuration with per-stage thread budgets.
+    """
+    threads = max(1, len(available_cpus()) // max(1, workers))
+    return {
+        "workers": workers,
+        "affinity": False,
+        "stages": {
+            "detection": {"torch_intra_op": threads, "torch_inter_op": 1, "opencv": threads},
+            "ocr": {"paddle": threads, "opencv": 1},
+            "layout": {"torch_intra_op": threads, "torch_inter_op": 1, "opencv": 1},
+        },
+    }
+
+
+def load_resource_config(path=RESOURCE_CONFIG_PATH, reload=False, workers=None):
+    """Load the resource configuration, falling back to defaults for missing entries.
+
+    Args:
+        path (str): Path to a JSON file with the same layout as default_config().
+        reload (bool): Re-read the file even if a configuration is already loaded.
+        workers (int): Actual number of workers, overriding the file. Stage budgets of
+            the file are only kept if it was written for that many workers (default:
+            value from the file, or 1).
+
+    Returns:
+        dict: Resource configuration.
+    """
+    global _config
+    if _config is not None and not reload:
+        return _config
+
+    user_config = {}
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                user_config = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read resource config {path}: {str(e)}")
+
+    config = default_config(workers or user_config.get("workers", 1))
+    config["affinity"] = user_config.get("affinity", config["affinity"])
+    stages = user_config.get("stages", {})
+    if stages and config["workers"] != user_config.get("workers", 1):
+        # Budgets in the file were sized for another pool and would oversubscribe this one
+        logging.warning(f"Ignoring stage budgets of {path}: sized for {user_config.get('workers', 1)} worker(s), running {config['workers']}")
+        stages = {}
+    for stage, budget in stages.items():
+        config["stages"].setdefault(stage, {}).update(budget)
+
+    _config = config
+    return config
+
+
+def stage_threads(stage):
+    """Return the thread budget of a pipeline stage.
+
+    Args:
+        stage (str): One of STAGES.
+
+    Returns:
+        dict: Thread counts per library for this stage.
+
+    Raises:
+        KeyError: If the stage is not configured.
+    """
+    stages = load_resource_config()["stages"]
+    if stage not in stages:
+        raise KeyError(f"Unknown stage '{stage}'. Available stages: {list(stages)}")
+    return stages[stage]
+
+
+def apply_environment():
+    """Export thread counts for the OpenMP/BLAS runtimes.
+
+    Must run before torch, paddle or cv2 are imported to have any effect. Variables
+    already set by the user are left untouched.
+    """
+    stages = load_resource_config()["stages"].values()
+    threads = max(max(budget.values()) for budget in stages)
+    for var in THREAD_ENV_VARS:
+        os.environ.setdefault(var, str(threads))
+
+
+def configure_threads(stage):
+    """Apply the thread budget of a stage to the libraries already imported.
+
+    Args:
+        stage (str): One of STAGES.
+
+    Returns:
+        dict: Thread counts applied for this stage.
+    """
+    budget = stage_threads(stage)
+
+    if "torch_intra_op" in budget or "torch_inter_op" in budget:
+        try:
+            import torch
+            if "torch_intra_op" in budget:
+                torch.set_num_threads(budget["torch_intra_op"])
+            if "torch_inter_op" in budget and torch.get_num_interop_threads() != budget["torch_inter_op"]:
+                # Can only be set once, before any inter-op parallel work has started
+                torch.set_num_interop_threads(budget["torch_inter_op"])
+        except ImportError:
+            pass
+        except RuntimeError as e:
+            logging.warning(f"Could not set torch inter-op threads for {stage}: {str(e)}")
+
+    if "opencv" in budget:
+        try:
+            import cv2
+            cv2.setNumThreads(budget["opencv"])
+        except ImportError:
+            pass
+
+    return budget
+
+
+def set_worker_affinity(worker_index, workers=None):
+    """Pin a worker process to its own slice of the available CPUs.
+
+    Does nothing if affinity is disabled or unsupported.
+
+    Args:
+        worker_index (int): Index of the worker, from 0 to workers - 1.
+        workers (int): Number of workers sharing the CPUs (default: configured value).
+
+    Returns:
+        list or None: CPUs assigned to the worker, or None if affinity was not set.
+    """
+    config = load_resource_config()
+    if not config["affinity"] or not hasattr(os, "sched_setaffinity"):
+        return None
+
+    workers = workers or config["workers"]
+    cpus = available_cpus()
+    per_worker = max(1, len(cpus) // workers)
+    start = (worker_index % workers) * per_worker
+    assigned = cpus[start:start + per_worker] or cpus
+    os.sched_setaffinity(0, assigned)
+    return assigned
+
+
+def benchmark_config(workers, affinity=False):
+    """Build the configuration benchmarked by autotune for one candidate split.
+
+    Every library, except torch inter-op, gets the worker's full share of the cores,
+    which is also the budget written out when the candidate wins.
+
+    Args:
+        workers (int): Number of parallel worker processes.
+        affinity (bool): Pin each worker to its own slice of the CPUs.
+
+    Returns:
+        dict: Resource configuration with the same layout as default_config().
+    """
+    config = default_config(workers)
+    config["affinity"] = affinity
+    threads = max(1, len(available_cpus()) // max(1, workers))
+    for budget in config["stages"].values():
+        for library in budget:
+            if library != "torch_inter_op":
+                budget[library] = threads
+    return config
+
+
+def _benchmark_worker(worker_index, config, image_path, repeats, barrier, queue):
+    # Under spawn this file runs as __mp_main__: the budget must be set on the
+    # resources module that predict.py imports, not on this copy.
+    import resources
+
+    resources._config = config
+    resources.set_worker_affinity(worker_index)
+    resources.apply_environment()
+
+    from predict import predict_labels
+    predict_labels(image_path)  # warm-up: model download and lazy initialisation
+
+    # Time the workers while they all compete for the cores, not while a sibling warms up
+    barrier.wait()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predict_labels(image_path)
+    queue.put(time.perf_counter() - start)
+
+
+def _collect_timings(processes, queue, poll=5):
+    """Wait for one timing per process, or None as soon as one of them crashed."""
+    elapsed = []
+    while len(elapsed) < len(processes):
+        try:
+            elapsed.append(queue.get(timeout=poll))
+        except Empty:
+            crashed = [p for p in processes if p.exitcode not in (None, 0)]
+            if crashed or all(p.exitcode is not None for p in processes):
+                logging.error(f"Benchmark worker(s) exited with code {[p.exitcode for p in crashed]}")
+                return None
+    return elapsed
+
+
+def autotune(image_path, repeats=2, max_workers=None, output_path=RESOURCE_CONFIG_PATH):
+    """Find the workers x threads split with the best throughput on this machine.
+
+    Each candidate runs the OCR + LayoutLMv3 pipeline on a sample image in fresh
+    processes, so the thread settings apply before the libraries are loaded.
+
+    Args:
+        image_path (str): Sample table crop used for the benchmark.
+        repeats (int): Timed predictions per worker.
+        max_workers (int): Largest number of workers to try (default: number of CPUs).
+        output_path (str): Where to write the winning configuration, or None.
+
+    Returns:
+        dict: The best configuration found.
+    """
+    cpus = len(available_cpus())
+    max_workers = max_workers or cpus
+    ctx = mp.get_context("spawn")
+
+    best_config, best_throughput = None, 0.0
+    for workers in range(1, max_workers + 1):
+        threads = max(1, cpus // workers)
+        for affinity in ([False, True] if workers > 1 and hasattr(os, "sched_setaffinity") else [False]):
+            config = benchmark_config(workers, affinity)
+            queue, barrier = ctx.Queue(), ctx.Barrier(workers)
+            processes = [
+                ctx.Process(target=_benchmark_worker, args=(i, config, image_path, repeats, barrier, queue))
+                for i in range(workers)
+            ]
+            for p in processes:
+                p.start()
+            # A crashed worker leaves its siblings blocked on the barrier: they are terminated below
+            elapsed = _collect_timings(processes, queue)
+            for p in processes:
+                if elapsed is None:
+                    p.terminate()
+                p.join()
+            if elapsed is None:
+                print(f"workers={workers} threads={threads} affinity={affinity}: failed, skipped")
+                continue
+
+            throughput = workers * repeats / max(elapsed)
+            print(f"workers={workers} threads={threads} affinity={affinity}: {throughput:.2f} images/s")
+            if throughput > best_throughput:
+                best_throughput, best_config = throughput, config
+
+    if best_config is None:
+        raise RuntimeError("Every benchmark candidate failed, see the errors above")
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(best_config, f, indent=2)
+        print(f"Best split written to {output_path}: {best_config['workers']} worker(s), {best_throughput:.2f} images/s")
+    return best_config
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU thread budget for torch, Paddle and OpenCV")
+    parser.add_argument("--autotune", metavar="IMAGE", help="benchmark thread splits on a sample table image")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--output", default=RESOURCE_CONFIG_PATH)
+    args = parser.parse_args()
+
+    if args.autotune:
+        autotune(args.autotune, repeats=args.repeats, max_workers=args.max_workers, output_path=args.output)
+    else:
+        print(json.dumps(load_resource_config(args.output), indent=2))